@@ -5,9 +5,10 @@ setup(
     version="0.1.0",
     packages=find_packages(),
     install_requires=[
-        'python-json-logger>=2.0.0',  # For structured logging
         'click>=8.0.0',  # For CLI interface
         'requests>=2.31.0',  # For LLM backend communication
+        'watchfiles>=0.21',  # For event-driven log tailing
+        'orjson>=3.9.0',  # For fast JSON parsing
     ],
     entry_points={
         'console_scripts': [
@@ -17,5 +18,5 @@ setup(
     },
     author="Siavash",
     description="An intelligent terminal observer that captures, logs, and interprets terminal I/O using local LLM intelligence",
-    python_requires='>=3.6',
+    python_requires='>=3.9',
 )
\ No newline at end of file
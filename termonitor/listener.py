@@ -1,41 +1,72 @@
+import io
 import os
 import sys
 import time
-import click
-import logging
-from datetime import datetime
-from typing import Dict, Any, Optional
-from datetime import datetime
-from .llm_backend import OllamaBackend
+import queue
+import threading
+import orjson
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from watchfiles import Change, watch
+from .llm_backend import Interaction, MAX_BATCH_SIZE, OllamaBackend
 
 DEFAULT_LOG_DIR = os.path.expanduser('~/.termonitor/logs')
 DEFAULT_LOG_FILE = 'terminal.log'
+BATCH_WINDOW = 0.3  # Seconds to wait for more completed interactions before analyzing
+# watchfiles sleeps this many milliseconds between checks of the stop event and
+# signals, so it bounds both the idle wakeup rate (~20/s) and the extra latency
+WATCH_STEP_MS = 50
+LLM_QUEUE_SIZE = 8  # Completed interactions waiting for analysis before the oldest is dropped
+LLM_CONCURRENCY = int(os.environ.get('ECHOMIND_LLM_CONCURRENCY', '2'))  # Parallel Ollama requests
 
 class TerminalLogListener:
     def __init__(self, log_dir: str = DEFAULT_LOG_DIR, log_file: str = DEFAULT_LOG_FILE):
         self.log_path = os.path.join(log_dir, log_file)
         self.last_position = 0
+        self._fd: Optional[io.BufferedReader] = None
+        self._inode: Optional[int] = None
         self.current_interaction = []
         self.current_timestamp = None
         self.current_session_id = None
-        self.llm_backend = OllamaBackend()
+        self.llm_backend = OllamaBackend(pool_size=LLM_CONCURRENCY)
+        self.llm_queue: queue.Queue = queue.Queue(maxsize=LLM_QUEUE_SIZE)
+        self.dropped_interactions = 0
+        # Only live tailing may drop backlog; replaying existing history waits for the worker
+        self._live = False
+        self._stop_event = threading.Event()
 
-    def process_log_entry(self, line: str) -> None:
+        # Analyses run off the tail loop so log lines keep draining during generation
+        self._executor = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY)
+        self._slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+        self._llm_thread = threading.Thread(target=self._llm_worker, daemon=True)
+        self._llm_thread.start()
+
+        # Analyses may finish out of order; output is released in submission order
+        self._output_lock = threading.Lock()
+        self._next_seq = 0
+        self._pending_output: Dict[int, List[str]] = {}
+        self._finished = set()
+
+    def process_log_entry(self, line: bytes) -> None:
         """Process a single log entry, accumulating output until command completion."""
         try:
-            # Parse the log line format: timestamp [level] Session session_id: data
-            parts = line.split('] Session ', 1)
-            if len(parts) != 2:
-                return
-            
-            timestamp = parts[0].lstrip('[')  # Remove leading [
-            rest = parts[1]
-            session_id, data = rest.split(':', 1)
+            # Data records are NDJSON: {"s": session_id, "k": kind, "t": ns since epoch,
+            # "d": text} with shell output carried base64-encoded as "b" instead of "d"
+            try:
+                record = orjson.loads(line)
+                timestamp, session_id = record['t'], record['s']
+                if 'd' in record:
+                    data = record['d']
+                else:
+                    data = binascii.a2b_base64(record['b']).decode(errors='replace')
+            except (orjson.JSONDecodeError, binascii.Error, TypeError, KeyError):
+                return  # Control-plane messages from the monitor are plain text
             
             # Initialize or update session context
             if not self.current_session_id:
                 self.current_session_id = session_id
-                self.current_timestamp = timestamp
+                self.current_timestamp = self._format_timestamp(timestamp)
 
             # Add the data to current interaction
             if data.strip():
@@ -43,88 +74,258 @@ class TerminalLogListener:
 
             # Check for command completion marker
             if '%' in data:
-                # Get analysis from LLM backend
                 if self.current_interaction:
-                    try:
-                        # Clear screen before showing new analysis
-                        print('\033[2J\033[H', end='')  # ANSI escape sequence to clear screen and move cursor to home
-                        print(f"\n[{self.current_timestamp}] Session {self.current_session_id} Analysis:")
-                        
-                        # Process streaming response
-                        analysis_received = False
-                        for fragment in self.llm_backend.analyze_interaction(
-                            self.current_timestamp,
-                            self.current_session_id,
-                            self.current_interaction
-                        ):
-                            if fragment:
-                                analysis_received = True
-                                print(fragment, end='', flush=True)
-                        
-                        if not analysis_received:
-                            print("\nNo analysis available - please ensure Ollama is running.")
-                        print('\n')
-                    except Exception as e:
-                        print(f"\nError getting analysis: {str(e)}\n")
-                    finally:
-                        # Reset for next interaction
-                        self.current_interaction = []
-                        self.current_timestamp = None
-                        self.current_session_id = None
+                    self._queue_interaction(Interaction(
+                        self.current_timestamp,
+                        self.current_session_id,
+                        self.current_interaction
+                    ))
+
+                # Reset for next interaction
+                self.current_interaction = []
+                self.current_timestamp = None
+                self.current_session_id = None
 
         except Exception as e:
             print(f"Error processing log entry: {str(e)}")
 
-    def listen(self, follow: bool = True) -> None:
-        """Listen to the log file and process new entries."""
+    @staticmethod
+    def _format_timestamp(ts_ns: int) -> str:
+        """Format a record's nanosecond timestamp as local ISO-8601 with milliseconds."""
+        sec, ns = divmod(ts_ns, 1_000_000_000)
+        return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec))}.{ns // 1_000_000:03d}"
+
+    def _queue_interaction(self, interaction: Interaction) -> None:
+        """Hand a completed interaction to the analysis worker.
+
+        While tailing live, the oldest waiting interaction is dropped if the
+        worker is behind; otherwise this blocks until there is room.
+        """
+        # An interaction that arrives while earlier ones are still waiting or
+        # being shown must not clear the screen over their analyses
+        item = (interaction, self.llm_queue.unfinished_tasks == 0)
+        if not self._live:
+            self.llm_queue.put(item)
+            return
         try:
-            while True:
-                if not os.path.exists(self.log_path):
-                    print(f"Waiting for log file: {self.log_path}")
-                    if not follow:
-                        break
-                    time.sleep(0.1)
-                    continue
+            self.llm_queue.put_nowait(item)
+        except queue.Full:
+            try:
+                self.llm_queue.get_nowait()
+                self.llm_queue.task_done()
+                self.dropped_interactions += 1
+                print(f"Analysis is falling behind; skipped {self.dropped_interactions} "
+                      f"interaction(s) so far", file=sys.stderr)
+            except queue.Empty:
+                pass
+            self.llm_queue.put_nowait(item)
 
+    def _llm_worker(self) -> None:
+        """Dispatch queued interactions to the executor, coalescing those that complete close together."""
+        seq = 0
+        while True:
+            # Wait for a free worker first so backlog stays in the bounded queue
+            self._slots.acquire()
+            batch = [self.llm_queue.get()]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
                 try:
-                    current_size = os.path.getsize(self.log_path)
-                    if current_size < self.last_position:
-                        # File has been rotated or truncated
-                        self.last_position = 0
-                except OSError:
+                    batch.append(self.llm_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            clear = batch[0][1]
+            try:
+                self._executor.submit(self._analyze, seq, [interaction for interaction, _ in batch], clear)
+            except RuntimeError:
+                return  # The listener has shut down the executor
+            seq += 1
+
+    def _analyze(self, seq: int, batch: List[Interaction], clear: bool) -> None:
+        """Run one batch on an executor thread and release its output in order."""
+        try:
+            self._analyze_batch(seq, batch, clear)
+        finally:
+            self._finish(seq)
+            self._slots.release()
+            for _ in batch:
+                self.llm_queue.task_done()
+
+    def _emit(self, seq: int, text: str) -> None:
+        """Print text now if seq is the oldest unfinished batch, otherwise hold it back."""
+        with self._output_lock:
+            if seq == self._next_seq:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            else:
+                self._pending_output.setdefault(seq, []).append(text)
+
+    def _finish(self, seq: int) -> None:
+        """Mark seq as done and flush the held-back output of the batches after it."""
+        with self._output_lock:
+            self._finished.add(seq)
+            while self._next_seq in self._finished:
+                self._finished.remove(self._next_seq)
+                self._next_seq += 1
+                sys.stdout.write(''.join(self._pending_output.pop(self._next_seq, ())))
+            sys.stdout.flush()
+
+    def _analyze_batch(self, seq: int, batch: List[Interaction], clear: bool = True) -> None:
+        """Print the streamed analysis of each interaction in batch, optionally clearing the screen first."""
+        try:
+            if clear:
+                # Clear screen before showing new analysis
+                self._emit(seq, '\033[2J\033[H')  # ANSI escape sequence to clear screen and move cursor to home
+
+            # Process streaming response
+            current = None
+            received = set()
+            for index, fragment in self.llm_backend.analyze_interaction(batch):
+                if self._stop_event.is_set():
+                    return  # Closing the stream releases its connection
+                if not fragment:
                     continue
+                if index != current:
+                    if current is not None:
+                        self._emit(seq, '\n\n')
+                    current = index
+                    self._emit(seq, f"\n[{batch[index].timestamp}] Session {batch[index].session_id} Analysis:\n")
+                received.add(index)
+                self._emit(seq, fragment)
 
-                with open(self.log_path, 'r') as f:
-                    if self.last_position > 0:
-                        f.seek(self.last_position)
+            if current is not None:
+                self._emit(seq, '\n\n')
+            for index, interaction in enumerate(batch):
+                if index not in received:
+                    self._emit(seq, f"\n[{interaction.timestamp}] Session {interaction.session_id} Analysis:\n")
+                    if received:
+                        # The model answered but did not keep to the "### Analysis N" headers
+                        self._emit(seq, "\nThe batched analysis could not be split per interaction; see above.\n\n")
+                    else:
+                        self._emit(seq, "\nNo analysis available - please ensure Ollama is running.\n\n")
+        except Exception as e:
+            self._emit(seq, f"\nError getting analysis: {str(e)}\n\n")
+
+    def _reopen(self) -> None:
+        """Open the log file from the start and remember which inode it is."""
+        self._close()
+        self._fd = open(self.log_path, 'rb')
+        self._inode = os.fstat(self._fd.fileno()).st_ino
+        self.last_position = 0
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def _read_lines(self) -> None:
+        """Process every complete line appended to the open log file since the last read."""
+        if os.fstat(self._fd.fileno()).st_size < self.last_position:
+            # File has been truncated in place
+            self._fd.seek(0)
+            self.last_position = 0
+
+        while True:
+            line = self._fd.readline()
+            if not line.endswith(b'\n'):
+                # EOF, or a record the monitor is still writing
+                self._fd.seek(self.last_position)
+                break
+            self.process_log_entry(line)
+            self.last_position = self._fd.tell()
+
+    def _drain(self, check_rotation: bool = False) -> None:
+        """Read new log lines, following the file to a new inode when it is rotated."""
+        if self._fd is None:
+            try:
+                self._reopen()
+            except FileNotFoundError:
+                return
+        elif check_rotation:
+            try:
+                inode = os.stat(self.log_path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if inode != self._inode:
+                # Finish what was written before the rotation, then switch files
+                self._read_lines()
+                if inode is None:
+                    self._close()
+                    return
+                self._reopen()
+        self._read_lines()
 
-                    while True:
-                        where = f.tell()
-                        line = f.readline()
-                        if not line:
-                            f.seek(where)  # Return to last position if no new data
-                            if not follow:
-                                return
-                            time.sleep(0.1)  # Increased sleep time to reduce CPU usage
-                            break  # Break inner loop to recheck file size
+    def _shutdown(self) -> None:
+        """Abandon queued and in-flight analyses so exiting does not wait on generation."""
+        self._stop_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.llm_backend.close()
 
-                        self.process_log_entry(line)
-                        self.last_position = f.tell()
+    def stop(self) -> None:
+        """Stop a running listen() loop."""
+        self._stop_event.set()
+
+    def listen(self, follow: bool = True) -> None:
+        """Listen to the log file and process new entries."""
+        try:
+            if not os.path.exists(self.log_path):
+                print(f"Waiting for log file: {self.log_path}")
+                if not follow:
+                    return
+            else:
+                self._drain()
+                if not follow:
+                    self.llm_queue.join()
+                    return
+
+            # Existing history has been replayed; from here on keep up with the shell
+            self._live = True
+
+            # Change notifications come from inotify/FSEvents/kqueue rather than
+            # stat polling; the watcher still wakes every WATCH_STEP_MS to check
+            # for stop requests. The directory is watched rather than the file so
+            # that creation and rotation of the log are seen as well.
+            log_dir = os.path.dirname(os.path.abspath(self.log_path))
+            os.makedirs(log_dir, exist_ok=True)
+            log_path = os.path.abspath(self.log_path)
+            for changes in watch(
+                log_dir,
+                watch_filter=lambda change, path: path == log_path,
+                debounce=100,
+                step=WATCH_STEP_MS,
+                stop_event=self._stop_event,
+                recursive=False,
+            ):
+                # Only creation/removal of the path can mean a rotation; plain
+                # modifications are read from the already open file
+                self._drain(check_rotation=any(change != Change.modified for change, _ in changes))
 
         except KeyboardInterrupt:
             print("\nStopping log listener...")
         except Exception as e:
             print(f"Error: {str(e)}")
             sys.exit(1)
+        finally:
+            self._close()
+            self._shutdown()
 
-@click.command()
-@click.option('--log-dir', default=DEFAULT_LOG_DIR, help='Directory containing log files')
-@click.option('--log-file', default=DEFAULT_LOG_FILE, help='Name of the log file to monitor')
-@click.option('--no-follow', is_flag=True, help='Do not follow the log file for new entries')
-def main(log_dir: str, log_file: str, no_follow: bool) -> None:
+def main() -> None:
     """Start the terminal log listener."""
-    listener = TerminalLogListener(log_dir, log_file)
-    listener.listen(not no_follow)
+    # Imported here so that using TerminalLogListener as a library does not pay for click
+    import click
+
+    @click.command()
+    @click.option('--log-dir', default=DEFAULT_LOG_DIR, help='Directory containing log files')
+    @click.option('--log-file', default=DEFAULT_LOG_FILE, help='Name of the log file to monitor')
+    @click.option('--no-follow', is_flag=True, help='Do not follow the log file for new entries')
+    def cli(log_dir: str, log_file: str, no_follow: bool) -> None:
+        """Start the terminal log listener."""
+        listener = TerminalLogListener(log_dir, log_file)
+        listener.listen(not no_follow)
+
+    cli()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,59 +1,94 @@
-import json
+import re
 import sys
+import itertools
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Tuple
+
+# Larger batches amortize the system prompt further but delay every analysis in them
+MAX_BATCH_SIZE = 4
+KEEP_ALIVE = "10m"  # Keep the model loaded between bursts of interactions
+MAX_CONTEXT_TOKENS = 2048  # Past this the cached context is dropped and the system prompt resent
+
+SYSTEM_PROMPT = """
+You are a terminal command analysis expert, who is talking directly to the user as you observe their terminal interactions. Your role is to analyze terminal interactions and provide insights about:
+1. The purpose and functionality of commands being used
+2. Potential security implications or risks
+3. Best practices and possible improvements
+4. Command efficiency and alternatives
+5. Common pitfalls or mistakes to avoid
+
+Consider the shell environment, command flags, and overall context of the interaction. Focus on providing practical, security-conscious advice while explaining complex concepts clearly."""
+
+# Extracts the "response" string from a streamed chunk without parsing the whole object
+_RESPONSE_FIELD = re.compile(rb'"response":"((?:[^"\\]|\\.)*)"')
+# Only the header token; any text after it on the same line belongs to the analysis
+_ANALYSIS_HEADER = re.compile(r'#+[ \t]*Analysis[ \t]+(\d+)[ \t]*:?[ \t]*\n?')
+
+class _ErrorMessage(str):
+    """An error yielded by the backend in place of generated text."""
+
+class Interaction(NamedTuple):
+    """A completed terminal interaction waiting to be analyzed."""
+    timestamp: str
+    session_id: str
+    lines: List[str]
 
 class BaseLLMBackend(ABC):
     """Base class for LLM backends that can analyze terminal interactions."""
     
     @abstractmethod
-    def analyze_interaction(self, timestamp: str, session_id: str, interaction: list[str]) -> str:
-        """Analyze a terminal interaction and return insights.
+    def analyze_interaction(self, interactions: List[Interaction]) -> Iterator[Tuple[int, str]]:
+        """Analyze a batch of terminal interactions and yield insights.
         
         Args:
-            timestamp: The timestamp of the interaction
-            session_id: The session identifier
-            interaction: List of terminal interaction lines
+            interactions: Completed interactions to analyze in a single request
             
-        Returns:
-            str: Analysis of the terminal interaction
+        Yields:
+            Tuple[int, str]: Index into interactions and a fragment of its analysis
         """
         pass
 
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+        pass
+
 class OllamaBackend(BaseLLMBackend):
     """Ollama-based LLM backend using llama3.2 model."""
     
-    def __init__(self, model: str = "llama3.2", api_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = "llama3.2", api_url: str = "http://localhost:11434", pool_size: int = 4):
         """Initialize the Ollama backend.
         
         Args:
             model: The model to use (default: llama2)
             api_url: The Ollama API URL (default: http://localhost:11434)
+            pool_size: Keep-alive connections to hold, at least the number of concurrent requests (default: 4)
         """
         self.model = model
         self.api_url = api_url.rstrip('/')
-        
-    def analyze_interaction(self, timestamp: str, session_id: str, interaction: list[str]) -> str:
-        """Analyze a terminal interaction using Ollama."""
-        # Prepare the interaction text
-        interaction_text = '\n'.join(interaction)
-        
-        # System prompt to provide context about terminal command analysis
-        system_prompt = """
-You are a terminal command analysis expert, who is talking directly to the user as you observe their terminal interactions. Your role is to analyze terminal interactions and provide insights about:
-1. The purpose and functionality of commands being used
-2. Potential security implications or risks
-3. Best practices and possible improvements
-4. Command efficiency and alternatives
-5. Common pitfalls or mistakes to avoid
 
-Consider the shell environment, command flags, and overall context of the interaction. Focus on providing practical, security-conscious advice while explaining complex concepts clearly."""
-        
-        # Prepare the prompt for command analysis
-        prompt = f"""{system_prompt}
+        # Reuse one keep-alive connection pool for every request to the server
+        self.session = requests.Session()
+        self.session.mount(self.api_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({'Connection': 'keep-alive', 'Content-Type': 'application/json'})
+
+        # Token context returned by the last successful generation; once the
+        # server has seen the system prompt it is not sent again
+        self._context: Optional[List[int]] = None
+        self._context_model: Optional[str] = None
 
-Analyze the following terminal interaction and in one small paragraph provide insights about the commands used, their purpose, and any potential improvements or security considerations:
+    def close(self) -> None:
+        """Close the keep-alive connections to the server."""
+        self.session.close()
+
+    def _build_prompt(self, interactions: List[Interaction]) -> str:
+        """Build a single prompt covering every interaction in the batch, without the system prompt."""
+        if len(interactions) == 1:
+            timestamp, session_id, lines = interactions[0]
+            interaction_text = '\n'.join(lines)
+            return f"""Analyze the following terminal interaction and in one small paragraph provide insights about the commands used, their purpose, and any potential improvements or security considerations:
 
 Timestamp: {timestamp}
 Session: {session_id}
@@ -62,58 +97,174 @@ Interaction:
 {interaction_text}
 
 Analysis:"""
-        
+
+        sections = []
+        for i, (timestamp, session_id, lines) in enumerate(interactions, 1):
+            interaction_text = '\n'.join(lines)
+            sections.append(f"""### Interaction {i}
+Timestamp: {timestamp}
+Session: {session_id}
+
+{interaction_text}""")
+        interactions_text = '\n\n'.join(sections)
+        return f"""Analyze each of the following {len(interactions)} terminal interactions separately. For each one, start a new line with the header "### Analysis N" (where N is the interaction number) and then in one small paragraph provide insights about the commands used, their purpose, and any potential improvements or security considerations:
+
+{interactions_text}
+
+### Analysis 1
+"""
+
+    def _split_analyses(self, fragments: Iterator[str], count: int) -> Iterator[Tuple[int, str]]:
+        """Attribute streamed fragments to interactions using the "### Analysis N" headers."""
+        index = 0
+        pending = ''
+        for fragment in itertools.chain(fragments, (None,)):
+            final = fragment is None
+            if isinstance(fragment, _ErrorMessage):
+                # Errors concern the whole request, so every interaction reports them
+                if pending:
+                    yield index, pending
+                    pending = ''
+                for i in range(count):
+                    yield i, fragment
+                continue
+            if not final:
+                pending += fragment
+            while True:
+                match = _ANALYSIS_HEADER.search(pending)
+                if not match:
+                    break
+                # A header at the very end may still grow more digits or its colon
+                if not final and match.end() == len(pending) and not pending.endswith('\n'):
+                    break
+                if match.start():
+                    yield index, pending[:match.start()]
+                index = min(max(int(match.group(1)) - 1, 0), count - 1)
+                pending = pending[match.end():]
+
+            # Hold back a trailing line that may still turn into a header
+            hold = len(pending) if final else pending.find('#', pending.rfind('\n') + 1)
+            if hold == -1:
+                hold = len(pending)
+            if hold:
+                yield index, pending[:hold]
+                pending = pending[hold:]
+
+    def analyze_interaction(self, interactions: List[Interaction]) -> Iterator[Tuple[int, str]]:
+        """Analyze a batch of terminal interactions using a single Ollama request."""
+        prompt = self._build_prompt(interactions)
+        context = self._context if self._context_model == self.model else None
+        if context is None:
+            prompt = f"{SYSTEM_PROMPT}\n\n{prompt}"
+        fragments = self._generate(prompt, context)
+        if len(interactions) == 1:
+            for fragment in fragments:
+                yield 0, fragment
+        else:
+            yield from self._split_analyses(fragments, len(interactions))
+
+    def _store_context(self, context: Optional[List[int]]) -> None:
+        """Remember the server's context for the next request, unless it has grown too long."""
+        if context and len(context) <= MAX_CONTEXT_TOKENS:
+            self._context = context
+            self._context_model = self.model
+        else:
+            self._context = None
+
+    @staticmethod
+    def _iter_lines(response: requests.Response) -> Iterator[bytearray]:
+        """Split a streamed NDJSON body into raw records without decoding it."""
+        buffer = bytearray()
+        for data in response.iter_content(chunk_size=None):
+            buffer += data
+            start = 0
+            while True:
+                end = buffer.find(b'\n', start)
+                if end == -1:
+                    break
+                if end > start:
+                    yield buffer[start:end]
+                start = end + 1
+            del buffer[:start]
+        if buffer.strip():
+            yield buffer
+
+    def _generate(self, prompt: str, context: Optional[List[int]] = None) -> Iterator[str]:
+        """Stream the model's response to prompt, yielding errors as fragments."""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": KEEP_ALIVE
+        }
+        if context is not None:
+            payload["context"] = context
         try:
-            # Make request to Ollama API with streaming enabled
-            response = requests.post(
+            # Make request to Ollama API with streaming enabled; closing the
+            # response hands its connection back to the session's pool
+            with self.session.post(
                 f"{self.api_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": True
-                },
+                json=payload,
                 stream=True,
                 timeout=30  # Add timeout to prevent hanging
-            )
-            response.raise_for_status()
+            ) as response:
+                response.raise_for_status()
             
-            # Process the streaming response
-            full_response = ""
-            for line in response.iter_lines(decode_unicode=True):
-                if line:
+                # Process the streaming response
+                full_response = ""
+                for line in self._iter_lines(response):
+                    # Fast path: ordinary token chunks only need their "response" string;
+                    # the final and error chunks still get a full parse below
+                    if b'"done":true' not in line and b'"error"' not in line:
+                        match = _RESPONSE_FIELD.search(line)
+                        if match:
+                            raw = match.group(1)
+                            fragment = orjson.loads(b'"%s"' % raw) if b'\\' in raw else raw.decode(errors='replace')
+                            if fragment:
+                                full_response += fragment
+                                yield fragment
+                            continue
+
                     try:
                         # Parse the JSON response
-                        chunk = json.loads(line)
+                        chunk = orjson.loads(line)
                         if 'response' in chunk:
                             # Get the response fragment
                             fragment = chunk['response']
-                            if fragment.strip():  # Only process non-empty fragments
+                            if fragment:  # Whitespace is kept so batch headers stay on their own line
                                 full_response += fragment
                                 yield fragment
+                            if chunk.get('done'):
+                                self._store_context(chunk.get('context'))
                         elif 'error' in chunk:
+                            self._context = None
                             error_msg = f"Ollama error: {chunk['error']}"
                             print(error_msg, file=sys.stderr)
-                            yield error_msg
-                    except json.JSONDecodeError as e:
+                            yield _ErrorMessage(error_msg)
+                    except orjson.JSONDecodeError as e:
+                        self._context = None
                         error_msg = f"Error decoding response: {e}"
                         print(error_msg, file=sys.stderr)
-                        yield error_msg
-            
+                        yield _ErrorMessage(error_msg)
+
             # If no response was received, yield an error message
             if not full_response.strip():
                 error_msg = "No response received from Ollama. Please check if the service is running and the model is loaded."
                 print(error_msg, file=sys.stderr)
-                yield error_msg
+                yield _ErrorMessage(error_msg)
             
         except requests.exceptions.Timeout:
+            self._context = None
             error_msg = "Request to Ollama timed out. Please check the service."
             print(error_msg, file=sys.stderr)
-            yield error_msg
+            yield _ErrorMessage(error_msg)
         except requests.exceptions.RequestException as e:
+            self._context = None
             error_msg = f"Error connecting to Ollama: {str(e)}"
             print(error_msg, file=sys.stderr)
-            yield error_msg
+            yield _ErrorMessage(error_msg)
         except Exception as e:
+            self._context = None
             error_msg = f"Error analyzing interaction: {str(e)}"
             print(error_msg, file=sys.stderr)
-            yield error_msg
\ No newline at end of file
+            yield _ErrorMessage(error_msg)
\ No newline at end of file
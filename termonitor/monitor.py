@@ -4,6 +4,7 @@ import pty
 import time
 import click
 import select
+import selectors
 import signal
 import struct
 import fcntl
@@ -11,34 +12,119 @@ import errno
 import termios
 import logging
 import re
+import queue
+import binascii
+import atexit
+import threading
+import orjson
 from termonitor import __version__
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import WatchedFileHandler
 from contextlib import contextmanager
 
 DEFAULT_LOG_DIR = os.path.expanduser('~/.termonitor/logs')
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10MB
 MAX_LOG_FILES = 5
-BUFFER_SIZE = 4096  # Increased buffer size for better performance
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+BUFFER_SIZE = 65536  # Matches typical pipe capacity to reduce syscall count
+LOG_QUEUE_SIZE = 10000  # Records waiting for the log writer before new ones are dropped
+LOG_BATCH_SIZE = 256  # Records the log writer hands to a single writev
+
+ANSI_ESCAPE = re.compile(rb'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+def strip_ansi(buf: bytes) -> bytes:
+    """Remove ANSI escape sequences from raw terminal bytes."""
+    # Most pty reads carry no escape codes at all, so skip the regex for them
+    if buf.find(b'\x1b') == -1:
+        return buf
+    return ANSI_ESCAPE.sub(b'', buf)
 
 # Configure plain text formatter
 class PlainTextFormatter(logging.Formatter):
     def __init__(self):
         super().__init__('%(asctime)s [%(levelname)s] Session %(session_id)s: %(message)s')
-        self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    
+        self._prefix = 'Session N/A: '
+        self._last_sec = -1
+        self._last_ts_str = ''
+
+    def set_session(self, session_id):
+        """Use session_id for records that do not carry their own."""
+        self._prefix = f'Session {session_id}: '
+
+    def formatTime(self, record, datefmt=None):
+        # Records within the same second share one strftime result
+        sec = int(record.created)
+        if sec != self._last_sec:
+            self._last_sec = sec
+            self._last_ts_str = time.strftime(self.default_time_format, self.converter(sec))
+        return f'{self._last_ts_str},{int(record.msecs):03d}'
+
     def format(self, record):
-        if not hasattr(record, 'session_id'):
-            record.session_id = 'N/A'
-        if hasattr(record, 'data'):
-            # Strip ANSI escape codes from the data
-            record.msg = self.ansi_escape.sub('', record.data)
-        elif hasattr(record, 'error'):
-            record.msg = f"Error: {record.error}"
-        return super().format(record)
+        # Terminal data is written by the log worker; only control-plane
+        # messages and errors pass through here
+        if hasattr(record, 'error'):
+            message = f"Error: {record.error}"
+        else:
+            message = record.getMessage()
+        prefix = f'Session {record.session_id}: ' if hasattr(record, 'session_id') else self._prefix
+        return f'{self.formatTime(record)} [{record.levelname}] {prefix}{message}'
 
 formatter = PlainTextFormatter()
 
+class RawRotator:
+    """Size-based rotating append-only log written with plain os.writev calls."""
+
+    def __init__(self, path, max_bytes=MAX_LOG_SIZE, backup_count=MAX_LOG_FILES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, chunks):
+        """Append a list of byte strings with a single writev()."""
+        # Other monitors append to and rotate the same file, so the real file
+        # state is checked once per batch instead of trusting a local count
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is None or not os.path.samestat(current, os.fstat(self.fd)):
+            # Another monitor rotated the file away; follow it to the new one
+            os.close(self.fd)
+            self._open()
+        os.writev(self.fd, chunks)
+        if os.fstat(self.fd).st_size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Shift terminal.log to terminal.log.1 (and so on) and reopen a fresh file."""
+        try:
+            # Other monitors append to the same file; only one of them may shift it
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # Another monitor is rotating; retry on the next write
+        try:
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            # Skip the shift if another monitor already rotated this file away
+            if current is not None and os.path.samestat(current, os.fstat(self.fd)):
+                for i in range(self.backup_count - 1, 0, -1):
+                    src = f'{self.path}.{i}'
+                    if os.path.exists(src):
+                        os.rename(src, f'{self.path}.{i + 1}')
+                os.rename(self.path, f'{self.path}.1')
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self._open()
+
+    def close(self):
+        os.close(self.fd)
+
 class TerminalMonitor:
     def __init__(self, log_dir=DEFAULT_LOG_DIR):
         self.log_dir = log_dir
@@ -47,22 +133,22 @@ class TerminalMonitor:
 
     def setup_logging(self):
         try:
-            os.makedirs(self.log_dir, exist_ok=True)
             log_file = os.path.join(self.log_dir, 'terminal.log')
-            
-            # Ensure log directory permissions are correct
-            os.chmod(self.log_dir, 0o755)
-            
-            handler = RotatingFileHandler(
-                log_file,
-                maxBytes=MAX_LOG_SIZE,
-                backupCount=MAX_LOG_FILES,
-                delay=False
-            )
-            
-            # Ensure log file permissions are correct
-            if os.path.exists(log_file):
-                os.chmod(log_file, 0o644)
+
+            # Create the directory and log file with the right permissions
+            # up front instead of fixing them afterwards
+            prev_umask = os.umask(0o022)
+            try:
+                os.makedirs(self.log_dir, mode=0o755, exist_ok=True)
+
+                # The rotator renames the file underneath this handler, so it must reopen
+                handler = WatchedFileHandler(log_file, delay=False)
+
+                # Terminal data bypasses the logging module and is appended to the
+                # same file through a raw fd; the logger is kept for errors only
+                self.rotator = RawRotator(log_file)
+            finally:
+                os.umask(prev_umask)
             
             handler.setFormatter(formatter)
             handler.setLevel(logging.INFO)
@@ -70,13 +156,47 @@ class TerminalMonitor:
             self.logger = logging.getLogger('termonitor')
             self.logger.addHandler(handler)
             self.logger.setLevel(logging.INFO)
-            
-            # Fix recursive flush issue
-            self.logger.handlers[0].flush = handler.flush
+            self.log_handler = handler
+
+            # Records are encoded and written by a background thread so the
+            # pty relay never waits on the log file
+            self._log_q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            self.dropped_records = 0
+            threading.Thread(target=self._log_worker, daemon=True).start()
+            atexit.register(self.flush_log)
         except Exception as e:
             sys.stderr.write(f'Failed to setup logging: {str(e)}\n')
             sys.exit(1)
 
+    def _encode_record(self, kind, data, ts_ns):
+        data = strip_ansi(data)
+        if kind == 'output':
+            # Shell output is dense with control bytes; base64 avoids both the
+            # decode pass and JSON's per-byte escaping
+            return self._record_templates[kind] % (ts_ns, binascii.b2a_base64(data, newline=False))
+        return self._record_templates[kind] % (ts_ns, orjson.dumps(data.decode(errors='replace')))
+
+    def _log_worker(self):
+        while True:
+            # Whatever queued up while the last batch was written goes out in one write
+            records = [self._log_q.get()]
+            while len(records) < LOG_BATCH_SIZE:
+                try:
+                    records.append(self._log_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.rotator.write([self._encode_record(*record) for record in records])
+            except Exception as e:
+                self.logger.error('', extra={'error': f'Failed to write terminal data: {e}'})
+            finally:
+                for _ in records:
+                    self._log_q.task_done()
+
+    def flush_log(self):
+        """Block until every queued record has been written."""
+        self._log_q.join()
+
     @contextmanager
     def _handle_terminal(self):
         master_fd, slave_fd = pty.openpty()
@@ -92,7 +212,6 @@ class TerminalMonitor:
             if 'old_term' in locals():
                 termios.tcsetattr(sys.stdin, termios.TCSANOW, old_term)
             os.close(master_fd)
-            os.close(slave_fd)
 
     def _get_terminal_size(self):
         try:
@@ -102,76 +221,150 @@ class TerminalMonitor:
         except Exception:
             return {'rows': 24, 'cols': 80}  # Default fallback size
 
+    def _read_available(self, fd, view):
+        """Read from a non-blocking fd until it runs dry or view is full.
+
+        Returns the number of bytes read into view and whether EOF was seen.
+        """
+        n = 0
+        while n < len(view):
+            try:
+                count = os.readv(fd, [view[n:]])
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                return n, True  # A pty master reports a closed slave as EIO
+            if not count:
+                return n, True
+            n += count
+        return n, False
+
+    def _write_all(self, fd, data):
+        """Write all of data to a possibly non-blocking fd."""
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except BlockingIOError:
+                select.select([], [fd], [])
+
     def monitor_session(self):
-        session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-        child_pid = None
-        
-        def handle_signal(signum, frame):
-            if signum in (signal.SIGTERM, signal.SIGINT):
-                if child_pid:
-                    try:
-                        os.kill(child_pid, signal.SIGTERM)
-                        os.waitpid(child_pid, 0)
-                    except OSError:
-                        pass
-                sys.exit(0)
-        
-        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
-            signal.signal(sig, handle_signal)
-        
+        session_id = time.strftime('%Y%m%d_%H%M%S')
+
         with self._handle_terminal() as (master_fd, slave_fd):
-            # Fork a child process
-            pid = os.fork()
-            
-            if pid == 0:  # Child process
-                try:
-                    os.setsid()  # Create new session
-                    os.dup2(slave_fd, 0)  # stdin
-                    os.dup2(slave_fd, 1)  # stdout
-                    os.dup2(slave_fd, 2)  # stderr
-                    
-                    # Set terminal size
-                    term_size = self._get_terminal_size()
-                    fcntl.ioctl(slave_fd, termios.TIOCSWINSZ,
-                               struct.pack('HHHH', term_size['rows'], term_size['cols'], 0, 0))
-                    
-                    # Execute the user's shell
-                    shell = os.environ.get('SHELL', '/bin/bash')
-                    os.execvp(shell, [shell])
-                except Exception as e:
-                    sys.stderr.write(f'Child process error: {str(e)}\n')
-                    sys.exit(1)
-            
-            # Parent process
+            # Set terminal size; the slave end shares it with the master
+            term_size = self._get_terminal_size()
+            fcntl.ioctl(master_fd, termios.TIOCSWINSZ,
+                        struct.pack('HHHH', term_size['rows'], term_size['cols'], 0, 0))
+
+            # Spawn the user's shell in a new session on the slave end, without
+            # copying this interpreter's address space the way fork() would
+            shell = os.environ.get('SHELL', '/bin/bash')
+            try:
+                pid = os.posix_spawnp(
+                    shell, [shell], os.environ,
+                    file_actions=[
+                        (os.POSIX_SPAWN_DUP2, slave_fd, 0),  # stdin
+                        (os.POSIX_SPAWN_DUP2, slave_fd, 1),  # stdout
+                        (os.POSIX_SPAWN_DUP2, slave_fd, 2),  # stderr
+                    ],
+                    setsid=True,
+                    setsigdef=(signal.SIGPIPE, *STOP_SIGNALS),
+                )
+            except OSError as e:
+                sys.stderr.write(f'Failed to start shell {shell}: {str(e)}\n')
+                sys.exit(1)
+            finally:
+                # Only the shell needs the slave end; holding it open here would
+                # keep the master from seeing EOF once the shell exits
+                os.close(slave_fd)
+
+            # Parent process. Every chunk has to reach userspace anyway to be
+            # stripped and encoded for the log, so a plain read/write relay
+            # costs fewer syscalls than splice()/tee() through an extra pipe.
+            buf = bytearray(BUFFER_SIZE)
+            view = memoryview(buf)
+            stdin_fd = sys.stdin.fileno()
+            stdout_fd = sys.stdout.fileno()
+            self.log_handler.formatter.set_session(session_id)
+
+            # Everything but the timestamp and data is constant for a session and kind
+            session_json = orjson.dumps(session_id)
+            self._record_templates = {
+                'output': b'{"s":%s,"k":"output","t":%%d,"b":"%%s"}\n' % session_json,
+                'input': b'{"s":%s,"k":"input","t":%%d,"d":%%s}\n' % session_json,
+            }
+
+            # Non-blocking so each wakeup drains everything the kernel holds
+            os.set_blocking(master_fd, False)
+
+            sel = selectors.DefaultSelector()
+            sel.register(master_fd, selectors.EVENT_READ, 'master')
+            sel.register(stdin_fd, selectors.EVENT_READ, 'stdin')
+
+            # Signals only write a byte to this pipe; the loop below notices it
+            # and shuts down outside of signal-handler context
+            sig_r, sig_w = os.pipe()
+            os.set_blocking(sig_w, False)
+            old_wakeup_fd = signal.set_wakeup_fd(sig_w)
+            old_handlers = {sig: signal.signal(sig, lambda signum, frame: None) for sig in STOP_SIGNALS}
+            sel.register(sig_r, selectors.EVENT_READ, 'signal')
+            # Python retries EINTR itself (PEP 475) and stop signals arrive
+            # through the wakeup pipe, so the loop needs no per-iteration handler
             try:
                 while self._running:
-                    try:
-                        r, w, e = select.select([master_fd, sys.stdin], [], [], 0.1)
-                        
-                        if master_fd in r:  # Data from the shell
-                            data = os.read(master_fd, BUFFER_SIZE)
-                            if not data:
-                                break
-                            os.write(sys.stdout.fileno(), data)
-                            self.logger.info('', extra={'session_id': session_id, 'data': data.decode(errors='replace')})
-                        
-                        if sys.stdin in r:  # Input from user
-                            data = os.read(sys.stdin.fileno(), BUFFER_SIZE)
-                            if not data:
-                                break
-                            os.write(master_fd, data)
-                            self.logger.info('', extra={'session_id': session_id, 'data': data.decode(errors='replace')})
-                            
-                    except OSError as e:
-                        if e.errno != errno.EINTR:  # Ignore interrupted system call
-                            raise
-                    except Exception as e:
-                        self.logger.error('', extra={'session_id': session_id, 'error': str(e)})
-                        break
+                    for key, _ in sel.select(timeout=None):
+                        if key.data == 'master':  # Data from the shell
+                            kind = 'output'
+                            n, eof = self._read_available(master_fd, view)
+                            if n:
+                                self._write_all(stdout_fd, view[:n])
+
+                        elif key.data == 'stdin':  # Input from user
+                            kind = 'input'
+                            n = os.readv(stdin_fd, [buf])
+                            eof = not n
+                            self._write_all(master_fd, view[:n])
+
+                        else:  # SIGTERM, SIGINT or SIGHUP
+                            # The wakeup fd carries the signal numbers;
+                            # logging is safe here, unlike in the handler
+                            signums = os.read(sig_r, BUFFER_SIZE)
+                            self.logger.info(f'Received {signal.Signals(signums[0]).name}, stopping')
+                            self._running = False
+                            break
+
+                        if n:
+                            try:
+                                self._log_q.put_nowait((kind, bytes(view[:n]), time.time_ns()))
+                            except queue.Full:
+                                self.dropped_records += 1
+                        if eof:
+                            self._running = False
+                            break
+            except OSError:
+                raise  # Reported by main()
+            except Exception as e:
+                self.logger.error('', extra={'error': str(e)})
             finally:
-                # Ensure child process is properly terminated
+                for sig, handler in old_handlers.items():
+                    signal.signal(sig, handler)
+                signal.set_wakeup_fd(old_wakeup_fd)
+                for fd in (master_fd, stdin_fd, sig_r):
+                    sel.unregister(fd)
+                sel.close()
+                os.close(sig_r)
+                os.close(sig_w)
+
+                self.flush_log()
+                if self.dropped_records:
+                    self.logger.warning('', extra={'error': f'Dropped {self.dropped_records} records while the log writer was behind'})
+
+                # Ensure child process is properly terminated; interactive shells
+                # ignore SIGTERM but exit on hangup, as with a closed terminal
                 try:
-                    os.kill(pid, signal.SIGTERM)
+                    os.kill(pid, signal.SIGHUP)
                     os.waitpid(pid, 0)
                 except OSError:
                     pass